@@ -3,30 +3,41 @@ import random
 import string
 from datetime import datetime, timedelta
 import io
-from threading import Thread
-from flask import Flask, render_template, redirect, url_for, request, flash, session, current_app
+from flask import Flask, render_template, redirect, url_for, request, flash, session, current_app, g
 from sqlalchemy import func
-from flask_login import login_user, login_required, logout_user, current_user
+from sqlalchemy.orm import joinedload
+from flask_login import login_required, logout_user, current_user
 from flask_mail import Message
 from fpdf import FPDF
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-from extensions import db, mail, login_manager, scheduler
+from extensions import db, mail, login_manager, scheduler, limiter, page_cache, queue
 from models import User, Product, Order, OrderItem, Category, FarmerProfile, \
                    DeliveryPartnerProfile, Transaction, Notification, Review, \
-                   CartItem, WishlistItem, Voucher, SupportTicket, AddressBook, InventoryAudit
+                   CartItem, WishlistItem, Voucher, SupportTicket, AddressBook, InventoryAudit, \
+                   ArchivedOrder
 from database_config import Config
+from db_routing import read_only
+from archival import archive_finished_orders, ensure_sqlite_autoincrement
+from forecasting import refresh_restock_suggestions
+from auth import hash_password, verify_password, needs_rehash, start_session, session_auth
 from sqlalchemy import text
 
 app = Flask(__name__)
 app.config.from_object(Config)
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = Config.get_engine_options()
+if app.config['PROXY_FIX_X_FOR'] > 0:
+    # remote_addr becomes the real client instead of the router, so per-IP rate limits stay per client
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'], x_proto=1)
 
 # Initialize Extensions
 db.init_app(app)
 mail.init_app(app)
 login_manager.init_app(app)
 login_manager.login_view = 'login'
+limiter.init_app(app)
+page_cache.init_app(app)
+queue.init_app(app)
 
 # Helper Functions
 @login_manager.user_loader
@@ -69,11 +80,7 @@ def send_receipt(order):
         msg.body += f'- {item.product.name}: {item.quantity} {item.product.unit} x ₹{item.price}\n'
     
     msg.body += '\nWe will notify you when it is out for delivery.'
-    
-    try:
-        mail.send(msg)
-    except Exception as e:
-        print(f"Error sending receipt: {e}")
+    mail.send(msg)
 
 def send_cancellation_email(order):
     msg = Message('Order Cancelled - Crop & Carry', recipients=[order.consumer.email])
@@ -85,24 +92,67 @@ def send_cancellation_email(order):
     
     If you have paid via UPI, the refund will be processed within 5-7 business days.
     '''
-    try:
-        mail.send(msg)
-    except Exception as e:
-        print(f"Error sending cancellation: {e}")
+    mail.send(msg)
+
+# Background Jobs (mail errors propagate so the queue retries them)
+@queue.task('send_receipt')
+def send_receipt_job(order_id):
+    order = db.session.get(Order, order_id)
+    if order:
+        send_receipt(order)
+
+@queue.task('send_cancellation_email')
+def send_cancellation_job(order_id):
+    order = db.session.get(Order, order_id)
+    if order:
+        send_cancellation_email(order)
+
+ACTIVE_STATUSES = ['Pending', 'Ready', 'Out for Delivery']
+
+def deliverable_orders():
+    # Orders a partner can pick up: single-farm orders and per-farm legs, never split parents
+    return Order.query.filter(
+        Order.status.in_(['Pending', 'Ready']),
+        Order.delivery_partner_id.is_(None),
+        ~Order.legs.any()
+    )
+
+def sync_parent_status(order):
+    if order.parent is None:
+        return
+    statuses = {leg.status for leg in order.parent.legs}
+    if statuses == {'Delivered'}:
+        order.parent.status = 'Delivered'
+    elif statuses & {'Out for Delivery', 'Delivered'}:
+        order.parent.status = 'Out for Delivery'
+
+@app.template_global()
+def url_for_page(page):
+    # Pagination links that keep the current filters (e.g. category_id); cached pages
+    # only keep the args their cache key varies on
+    args = request.args.to_dict()
+    if 'page_cache_vary_args' in g:
+        args = {name: value for name, value in args.items() if name in g.page_cache_vary_args}
+    args['page'] = page
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
 
 # Routes
 
 @app.route('/')
+@page_cache.cached_page('category_id', 'page')
+@read_only
 def index():
     categories = Category.query.all()
     category_id = request.args.get('category_id')
+    query = Product.query.options(joinedload(Product.farmer)).filter_by(is_deleted=False)
     if category_id:
-        products = Product.query.filter_by(category_id=category_id, is_deleted=False).all()
-    else:
-        products = Product.query.filter_by(is_deleted=False).all()
-    return render_template('market.html', products=products, categories=categories)
+        query = query.filter_by(category_id=category_id)
+    products = query.order_by(Product.id) \
+        .paginate(page=request.args.get('page', 1, type=int), per_page=app.config['MARKET_PER_PAGE'], error_out=False)
+    return render_template('market.html', products=products.items, categories=categories, pagination=products)
 
 @app.route('/signup', methods=['GET', 'POST'])
+@limiter.limit('5/hour', methods=['POST'])
 def signup():
     if request.method == 'POST':
         email = request.form.get('email')
@@ -116,7 +166,7 @@ def signup():
             flash('Email already exists')
             return redirect(url_for('signup'))
             
-        hashed_pw = generate_password_hash(password, method='pbkdf2:sha256')
+        hashed_pw = hash_password(password)
         new_user = User(email=email, password_hash=hashed_pw, role=role, name=name, phone=phone, address=address, is_verified=False)
         db.session.add(new_user)
         db.session.commit()
@@ -138,6 +188,7 @@ def signup():
     return render_template('signup.html')
 
 @app.route('/verify', methods=['GET', 'POST'])
+@limiter.limit('10/10minutes', scope='user', methods=['POST'])
 def verify_otp():
     if request.method == 'POST':
         otp = request.form.get('otp')
@@ -153,7 +204,7 @@ def verify_otp():
             user.otp_code = None
             user.otp_expiry = None
             db.session.commit()
-            login_user(user)
+            start_session(user)
             flash('Verified successfully!')
             return redirect(url_for('dashboard'))
         else:
@@ -161,6 +212,8 @@ def verify_otp():
     return render_template('verify.html')
 
 @app.route('/resend-otp')
+@limiter.limit('3/10minutes', scope='user')
+@limiter.limit('10/hour')
 def resend_otp():
     user_id = session.get('user_id_temp')
     if not user_id:
@@ -174,18 +227,24 @@ def resend_otp():
     return redirect(url_for('verify_otp'))
 
 @app.route('/login', methods=['GET', 'POST'])
+@limiter.limit('5/minute', scope='user', methods=['POST'])
+@limiter.limit('20/minute', methods=['POST'])
 def login():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
         user = User.query.filter_by(email=email).first()
         
-        if user and check_password_hash(user.password_hash, password):
+        if user and verify_password(user.password_hash, password):
+            if needs_rehash(user.password_hash):
+                # Transparently move the stored hash to the configured method and cost
+                user.password_hash = hash_password(password)
+                db.session.commit()
             if not user.is_verified:
                  send_otp(user)
                  session['user_id_temp'] = user.id
                  return redirect(url_for('verify_otp'))
-            login_user(user)
+            start_session(user)
             return redirect(url_for('dashboard'))
         flash('Invalid credentials')
     return render_template('login.html')
@@ -195,7 +254,7 @@ def login():
 def change_password():
     if request.method == 'POST':
         new_password = request.form.get('new_password')
-        current_user.password_hash = generate_password_hash(new_password)
+        current_user.password_hash = hash_password(new_password)
         db.session.commit()
         flash('Password updated successfully')
         return redirect(url_for('dashboard'))
@@ -205,13 +264,16 @@ def change_password():
 @login_required
 def logout():
     logout_user()
+    session.pop('auth_role', None)
     return redirect(url_for('index'))
 
 @app.route('/dashboard')
 @login_required
+@read_only
 def dashboard():
     if current_user.role == 'farmer':
-        products = Product.query.filter_by(farmer_id=current_user.id, is_deleted=False).all()
+        products = Product.query.options(joinedload(Product.restock_suggestion)) \
+            .filter_by(farmer_id=current_user.id, is_deleted=False).all()
         categories = Category.query.all()
         stats = db.session.query(
             func.sum(Product.total_sales).label('total_sales'),
@@ -224,40 +286,60 @@ def dashboard():
         return render_template('farmer_dashboard.html', products=products, categories=categories, total_sales=total_sales, sales_amount=sales_amount)
     
     elif current_user.role == 'delivery':
-        available_orders = Order.query.filter(
-            Order.status.in_(['Pending', 'Ready']),
-            Order.delivery_partner_id.is_(None)
-        ).all()
+        available_orders = deliverable_orders().all()
         
-        my_deliveries = Order.query.filter_by(delivery_partner_id=current_user.id).all()
-        return render_template('delivery_dashboard.html', available=available_orders, my_deliveries=my_deliveries)
+        my_deliveries = Order.query.filter_by(delivery_partner_id=current_user.id).order_by(Order.created_at.desc()) \
+            .paginate(page=request.args.get('page', 1, type=int), per_page=app.config['ORDERS_PER_PAGE'], error_out=False)
+        return render_template('delivery_dashboard.html', available=available_orders, my_deliveries=my_deliveries.items, pagination=my_deliveries)
     
     else: # Consumer
-        orders = Order.query.filter_by(consumer_id=current_user.id).order_by(Order.created_at.desc()).all()
-        return render_template('consumer_dashboard.html', orders=orders)
+        orders = Order.query.filter_by(consumer_id=current_user.id, parent_id=None).order_by(Order.created_at.desc()) \
+            .paginate(page=request.args.get('page', 1, type=int), per_page=app.config['ORDERS_PER_PAGE'], error_out=False)
+        active_orders = Order.query.filter(
+            Order.consumer_id == current_user.id,
+            Order.parent_id.is_(None),
+            Order.status.in_(ACTIVE_STATUSES)
+        ).all()
+        return render_template('consumer_dashboard.html', orders=orders.items, pagination=orders, active_orders=active_orders)
 
-@app.route('/api/delivery/available')
+@app.route('/orders/archive')
 @login_required
+@read_only
+def order_archive():
+    if current_user.role != 'consumer': return redirect(url_for('dashboard'))
+    orders = ArchivedOrder.query.filter_by(consumer_id=current_user.id, parent_id=None).order_by(ArchivedOrder.created_at.desc()) \
+        .paginate(page=request.args.get('page', 1, type=int), per_page=app.config['ORDERS_PER_PAGE'], error_out=False)
+    return render_template('consumer_dashboard.html', orders=orders.items, pagination=orders, archived=True)
+
+@app.route('/api/delivery/available')
+@session_auth
+@read_only
+@limiter.limit('30/minute', scope='user')
 def get_available_count():
-    if current_user.role != 'delivery': return {'count': 0}, 403
-    count = Order.query.filter(
-        Order.status.in_(['Pending', 'Ready']),
-        Order.delivery_partner_id.is_(None)
-    ).count()
+    if g.auth_role != 'delivery': return {'count': 0}, 403
+    count = deliverable_orders().count()
     return {'count': count}
 
 @app.route('/api/farmer/stats')
-@login_required
+@session_auth
+@read_only
+@limiter.limit('30/minute', scope='user')
 def get_farmer_stats():
-    if current_user.role != 'farmer': return {'total_sales': 0}, 403
-    stats = db.session.query(func.sum(Product.total_sales)).filter(Product.farmer_id == current_user.id).first()
+    if g.auth_role != 'farmer': return {'total_sales': 0}, 403
+    stats = db.session.query(func.sum(Product.total_sales)).filter(Product.farmer_id == g.auth_user_id).first()
     return {'total_sales': stats[0] or 0}
 
 @app.route('/api/consumer/order-updates')
-@login_required
+@session_auth
+@read_only
+@limiter.limit('30/minute', scope='user')
 def get_consumer_updates():
-    if current_user.role != 'consumer': return {'statuses': {}}, 403
-    orders = Order.query.filter_by(consumer_id=current_user.id).all()
+    if g.auth_role != 'consumer': return {'statuses': {}}, 403
+    orders = Order.query.filter(
+        Order.consumer_id == g.auth_user_id,
+        Order.parent_id.is_(None),
+        Order.status.in_(ACTIVE_STATUSES)
+    ).all()
     return {'statuses': {str(o.id): o.status for o in orders}}
 
 @app.route('/delivery/pick/<int:order_id>')
@@ -266,12 +348,15 @@ def pick_order(order_id):
     if current_user.role != 'delivery': return 'Unauthorized', 403
     order = Order.query.get(order_id)
     
+    if order.legs:
+        return 'Unauthorized', 403
     if order.delivery_partner_id is not None:
         flash('This order has already been taken by another partner.')
         return redirect(url_for('dashboard'))
         
     order.delivery_partner_id = current_user.id
     order.status = 'Out for Delivery'
+    sync_parent_status(order)
     db.session.commit()
     flash('Order assigned to you successfully!')
     return redirect(url_for('dashboard'))
@@ -369,6 +454,7 @@ def remove_from_cart(id):
     return redirect(url_for('view_cart'))
 
 @app.route('/cart')
+@read_only
 def view_cart():
     cart = session.get('cart', {})
     if isinstance(cart, list): cart = {}
@@ -400,6 +486,7 @@ def checkout():
     
     total_amount = 0
     final_cart_items = []
+    farm_groups = {}
     for p in products:
         qty = cart.get(str(p.id), 0)
         if qty > p.stock:
@@ -407,8 +494,9 @@ def checkout():
             return redirect(url_for('view_cart'))
         total_amount += (p.price * qty)
         final_cart_items.append((p, qty))
+        farm_groups.setdefault(p.farmer_id, []).append((p, qty))
     
-    # Use first product for pickup details (simplification)
+    # Single-farm carts keep the farm's pickup on the order itself
     main_p = products[0]
     order = Order(
         consumer_id=current_user.id, 
@@ -416,11 +504,28 @@ def checkout():
         payment_method=payment_method, 
         drop_address=drop_address,
         drop_phone=drop_phone,
-        pickup_address=main_p.pickup_address,
-        pickup_phone=main_p.pickup_phone
+        pickup_address=main_p.pickup_address if len(farm_groups) == 1 else None,
+        pickup_phone=main_p.pickup_phone if len(farm_groups) == 1 else None,
+        farmer_id=main_p.farmer_id if len(farm_groups) == 1 else None
     )
     db.session.add(order)
-    db.session.commit()
+    db.session.flush()
+    
+    # Multi-farm carts get one pickup leg per farm so partners can collect in parallel
+    if len(farm_groups) > 1:
+        for farmer_id, lines in farm_groups.items():
+            leg = Order(
+                parent_id=order.id,
+                farmer_id=farmer_id,
+                consumer_id=current_user.id,
+                total_amount=sum(p.price * qty for p, qty in lines),
+                payment_method=payment_method,
+                drop_address=drop_address,
+                drop_phone=drop_phone,
+                pickup_address=lines[0][0].pickup_address,
+                pickup_phone=lines[0][0].pickup_phone
+            )
+            db.session.add(leg)
     
     for p, qty in final_cart_items:
         item = OrderItem(order_id=order.id, product_id=p.id, quantity=qty, price=p.price)
@@ -428,9 +533,9 @@ def checkout():
         p.total_sales += qty
         db.session.add(item)
     
+    queue.enqueue('send_receipt', {'order_id': order.id}, priority=10, idempotency_key=f'receipt:{order.id}')
     db.session.commit()
     session.pop('cart', None)
-    send_receipt(order)
     flash('Order placed successfully!')
     return redirect(url_for('dashboard'))
 
@@ -441,16 +546,19 @@ def cancel_order(order_id):
     if order.consumer_id != current_user.id:
         flash('Unauthorized action')
         return redirect(url_for('dashboard'))
-    if order.status not in ['Pending', 'Ready']:
+    if order.parent_id is not None or order.status not in ['Pending', 'Ready'] or \
+            any(leg.status not in ['Pending', 'Ready'] for leg in order.legs):
         flash('Cannot cancel order that is already in progress.')
         return redirect(url_for('dashboard'))
         
     order.status = 'Cancelled'
+    for leg in order.legs:
+        leg.status = 'Cancelled'
     for item in order.items:
         item.product.stock += item.quantity
         item.product.total_sales -= item.quantity
+    queue.enqueue('send_cancellation_email', {'order_id': order.id}, priority=10, idempotency_key=f'cancellation:{order.id}')
     db.session.commit()
-    send_cancellation_email(order)
     flash('Order cancelled successfully.')
     return redirect(url_for('dashboard'))
 
@@ -461,6 +569,7 @@ def complete_order(order_id):
     order = Order.query.get(order_id)
     if order.delivery_partner_id != current_user.id: return 'Unauthorized', 403
     order.status = 'Delivered'
+    sync_parent_status(order)
     db.session.commit()
     return redirect(url_for('dashboard'))
 
@@ -505,25 +614,48 @@ def generate_pdf_report(farmer_name, sales_data, total_amount):
     pdf.cell(30, 10, f"INR {total_amount:.2f}", 0)
     return pdf.output(dest='S').encode('latin-1')
 
+@queue.task('daily_report')
 def send_daily_reports():
+    # One job per farmer, keyed by day, so a failed send is retried without re-mailing the rest
+    since = datetime.utcnow() - timedelta(days=1)
+    for farmer_id, in db.session.query(User.id).filter_by(role='farmer'):
+        queue.enqueue('farmer_daily_report', {'farmer_id': farmer_id, 'since': since.isoformat()},
+                      idempotency_key=f"daily_report:{since.strftime('%Y-%m-%d')}:{farmer_id}")
+
+@queue.task('farmer_daily_report')
+def send_farmer_daily_report(farmer_id, since):
+    farmer = db.session.get(User, farmer_id)
+    if farmer is None:
+        return
+    recent_orders = Order.query.filter(Order.created_at >= datetime.fromisoformat(since)).all()
+    sales_data = []
+    total_amount = 0.0
+    for order in recent_orders:
+        for item in order.items:
+            if item.product.farmer_id == farmer.id:
+                sales_data.append({'name': item.product.name, 'qty': item.quantity, 'price': item.product.price, 'total': item.quantity * item.product.price})
+                total_amount += (item.quantity * item.product.price)
+    if sales_data:
+        pdf_content = generate_pdf_report(farmer.name, sales_data, total_amount)
+        msg = Message(subject=f"Daily Sales Report - {datetime.utcnow().strftime('%Y-%m-%d')}", recipients=[farmer.email], body=f"Hello {farmer.name},\n\nPlease find attached your daily sales report.")
+        msg.attach("Daily_Report.pdf", "application/pdf", pdf_content)
+        mail.send(msg)
+
+@queue.task('archive_orders')
+def archive_orders():
+    archived = archive_finished_orders(app.config['ORDER_ARCHIVE_AFTER_DAYS'])
+    print(f"Archived {archived} finished orders.")
+
+@queue.task('refresh_forecasts')
+def refresh_forecasts():
+    count = refresh_restock_suggestions(app.config['FORECAST_HISTORY_DAYS'], app.config['FORECAST_HORIZON_DAYS'])
+    print(f"Refreshed restock suggestions for {count} products.")
+
+def enqueue_scheduled(name):
+    # Every web worker runs the scheduler; the per-day key makes sure only one job runs
     with app.app_context():
-        farmers = User.query.filter_by(role='farmer').all()
-        yesterday = datetime.utcnow() - timedelta(days=1)
-        for farmer in farmers:
-            recent_orders = Order.query.filter(Order.created_at >= yesterday).all()
-            sales_data = []
-            total_amount = 0.0
-            for order in recent_orders:
-                for item in order.items:
-                    if item.product.farmer_id == farmer.id:
-                        sales_data.append({'name': item.product.name, 'qty': item.quantity, 'price': item.product.price, 'total': item.quantity * item.product.price})
-                        total_amount += (item.quantity * item.product.price)
-            if sales_data:
-                pdf_content = generate_pdf_report(farmer.name, sales_data, total_amount)
-                msg = Message(subject=f"Daily Sales Report - {datetime.utcnow().strftime('%Y-%m-%d')}", recipients=[farmer.email], body=f"Hello {farmer.name},\n\nPlease find attached your daily sales report.")
-                msg.attach("Daily_Report.pdf", "application/pdf", pdf_content)
-                try: mail.send(msg)
-                except Exception as e: print(f"Failed to send report: {e}")
+        queue.enqueue(name, idempotency_key=f"{name}:{datetime.utcnow().strftime('%Y-%m-%d')}")
+        db.session.commit()
 
 # Scheduler Setup
 if not os.getenv('VERCEL'):
@@ -531,13 +663,18 @@ if not os.getenv('VERCEL'):
         scheduler.init_app(app)
         scheduler.start()
         if not scheduler.get_job('daily_report'):
-            scheduler.add_job(id='daily_report', func=send_daily_reports, trigger='interval', hours=24)
+            scheduler.add_job(id='daily_report', func=enqueue_scheduled, args=['daily_report'], trigger='interval', hours=24)
+        if not scheduler.get_job('archive_orders'):
+            scheduler.add_job(id='archive_orders', func=enqueue_scheduled, args=['archive_orders'], trigger='interval', hours=24)
+        if not scheduler.get_job('refresh_forecasts'):
+            scheduler.add_job(id='refresh_forecasts', func=enqueue_scheduled, args=['refresh_forecasts'], trigger='interval', hours=24)
     except Exception as e: print(f"Scheduler failed: {e}")
 
 # Create database tables and perform migrations
 with app.app_context():
     try: 
         db.create_all()
+        ensure_sqlite_autoincrement()
         # Incremental migrations for existing tables
         db.session.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS address TEXT"))
         db.session.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS phone TEXT"))
@@ -546,6 +683,12 @@ with app.app_context():
         db.session.execute(text("ALTER TABLE products ADD COLUMN IF NOT EXISTS pickup_phone TEXT"))
         db.session.execute(text("ALTER TABLE orders ADD COLUMN IF NOT EXISTS pickup_phone TEXT"))
         db.session.execute(text("ALTER TABLE orders ADD COLUMN IF NOT EXISTS drop_phone TEXT"))
+        db.session.execute(text("ALTER TABLE orders ADD COLUMN IF NOT EXISTS parent_id INTEGER REFERENCES orders(id)"))
+        db.session.execute(text("ALTER TABLE orders ADD COLUMN IF NOT EXISTS farmer_id INTEGER REFERENCES users(id)"))
+        db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_consumer_id ON orders (consumer_id)"))
+        db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_delivery_partner_id ON orders (delivery_partner_id)"))
+        db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_status ON orders (status)"))
+        db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_order_items_order_id ON order_items (order_id)"))
         db.session.commit()
         
         # Seed categories if they don't exist
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, or_, select, text
+from sqlalchemy.schema import CreateTable
+
+from extensions import db
+from models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+
+FINISHED_STATUSES = ['Delivered', 'Cancelled']
+
+def archive_finished_orders(older_than_days=30, batch_size=500):
+    """Moves finished orders (with their farm legs and items) into the archive tables.
+    Each batch is copied and deleted with set-based statements in its own transaction.
+    Returns the number of consumer-facing orders archived."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    order_cols = [c.name for c in Order.__table__.columns]
+    item_cols = [c.name for c in OrderItem.__table__.columns]
+    archived = 0
+
+    while True:
+        # Top-level orders only; legs always travel with their parent
+        parent_ids = db.session.scalars(
+            select(Order.id).where(
+                Order.parent_id.is_(None),
+                Order.status.in_(FINISHED_STATUSES),
+                Order.created_at < cutoff,
+                ~Order.transaction.has()
+            ).limit(batch_size)
+        ).all()
+        if not parent_ids:
+            return archived
+
+        order_filter = or_(Order.id.in_(parent_ids), Order.parent_id.in_(parent_ids))
+        order_ids = select(Order.id).where(order_filter)
+
+        db.session.execute(insert(ArchivedOrder).from_select(
+            order_cols, select(*[Order.__table__.c[c] for c in order_cols]).where(order_filter)))
+        db.session.execute(insert(ArchivedOrderItem).from_select(
+            item_cols, select(*[OrderItem.__table__.c[c] for c in item_cols]).where(OrderItem.order_id.in_(order_ids))))
+        db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(order_ids)))
+        db.session.execute(delete(Order).where(Order.parent_id.in_(parent_ids)))
+        db.session.execute(delete(Order).where(Order.id.in_(parent_ids)))
+        db.session.commit()
+        archived += len(parent_ids)
+
+def ensure_sqlite_autoincrement():
+    """SQLite hands the highest INTEGER PRIMARY KEY out again once that row is deleted, so a
+    new order could take an archived order's id. Rebuilds orders / order_items created before
+    they were AUTOINCREMENT and keeps their sequences above every archived id."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.begin() as conn:
+        for table, archive in ((Order.__table__, ArchivedOrder.__table__),
+                               (OrderItem.__table__, ArchivedOrderItem.__table__)):
+            ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                               {'name': table.name}).scalar()
+            if ddl and 'AUTOINCREMENT' not in ddl.upper():
+                _rebuild_table(conn, table)
+            top = conn.execute(select(func.max(archive.c.id))).scalar()
+            if top:
+                seq = conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = :name"), {'name': table.name}).scalar()
+                if seq is None:
+                    conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"), {'name': table.name, 'seq': top})
+                elif seq < top:
+                    conn.execute(text("UPDATE sqlite_sequence SET seq = :seq WHERE name = :name"), {'name': table.name, 'seq': top})
+
+def _rebuild_table(conn, table):
+    # SQLite cannot add AUTOINCREMENT in place: copy into a new table, then swap names
+    tmp_name = f'{table.name}_autoinc'
+    ddl = str(CreateTable(table).compile(dialect=conn.dialect)).strip()
+    conn.exec_driver_sql(ddl.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {tmp_name} ', 1))
+    existing = {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info({table.name})')}
+    cols = ', '.join(c.name for c in table.columns if c.name in existing)
+    conn.exec_driver_sql(f'INSERT INTO {tmp_name} ({cols}) SELECT {cols} FROM {table.name}')
+    conn.exec_driver_sql(f'DROP TABLE {table.name}')
+    conn.exec_driver_sql(f'ALTER TABLE {tmp_name} RENAME TO {table.name}')
+    for index in table.indexes:
+        index.create(conn)
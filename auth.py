@@ -0,0 +1,91 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import wraps
+from threading import Lock
+
+from flask import current_app, g, session
+from flask_login import current_user, login_user
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from extensions import login_manager
+
+_pool = None
+_pool_lock = Lock()
+_target_methods = {}
+# Weakest first; anything not listed (md5, sha1, plain) is always rehashed
+ALGORITHM_RANK = {'pbkdf2': 1, 'scrypt': 2}
+
+def _pool_size():
+    # PASSWORD_HASH_WORKERS is the budget for the whole node, shared by every gunicorn
+    # worker, with at least one process each; 0 hashes inline on the request thread.
+    # gevent workers never fork a pool.
+    config = current_app.config
+    if config['WEB_WORKER_CLASS'] == 'gevent' or config['PASSWORD_HASH_WORKERS'] <= 0:
+        return 0
+    return max(1, config['PASSWORD_HASH_WORKERS'] // max(1, config['WEB_CONCURRENCY']))
+
+def _executor():
+    # Created lazily so each gunicorn worker gets its own pool after forking
+    global _pool
+    workers = _pool_size()
+    if workers <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            # gthread request threads can race here; only the first one creates the pool
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=workers)
+    return _pool
+
+def _run(func, *args):
+    pool = _executor()
+    if pool is None:
+        return func(*args)
+    return pool.submit(func, *args).result(timeout=current_app.config['PASSWORD_HASH_TIMEOUT'])
+
+def hash_password(password):
+    return _run(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+def verify_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+def _strength(method):
+    # "pbkdf2:sha256:1000000" -> (1, 1000000); "scrypt:32768:8:1" -> (2, 262144)
+    name, *params = method.split(':')
+    if name == 'pbkdf2' and len(params) == 2 and params[0] in ('sha256', 'sha512'):
+        return ALGORITHM_RANK[name], int(params[1])
+    if name == 'scrypt' and len(params) == 3:
+        n, r, p = map(int, params)
+        return ALGORITHM_RANK[name], n * r * p
+    return 0, 0
+
+def needs_rehash(password_hash):
+    """True only when the stored hash is weaker than PASSWORD_HASH_METHOD, so a login never
+    moves a hash to a cheaper cost or from scrypt back to PBKDF2."""
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    if method not in _target_methods:
+        # Expands defaults, e.g. "scrypt" -> "scrypt:32768:8:1"; full cost, so off the request thread
+        _target_methods[method] = _run(generate_password_hash, '', method).split('$', 1)[0]
+    return _strength(password_hash.split('$', 1)[0]) < _strength(_target_methods[method])
+
+def start_session(user):
+    login_user(user)
+    # Cached in the signed session cookie so polling APIs can skip the User row load
+    session['auth_role'] = user.role
+
+def session_auth(view):
+    """Lighter @login_required for polling APIs: identity comes from the signed session
+    and is exposed as g.auth_user_id / g.auth_role without loading the User row."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        user_id = session.get('_user_id')
+        if user_id is None:
+            return login_manager.unauthorized()
+        if 'auth_role' not in session:
+            # Sessions started before the role was cached pay for one row load
+            if not current_user.is_authenticated:
+                return login_manager.unauthorized()
+            session['auth_role'] = current_user.role
+        g.auth_user_id = int(user_id)
+        g.auth_role = session['auth_role']
+        return view(*args, **kwargs)
+    return wrapped
@@ -7,7 +7,44 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL').replace("postgres://", "postgresql://", 1) if os.getenv('DATABASE_URL') else "sqlite:///site.db"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Optional read replica for @read_only views (see db_routing.py)
+    DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL', '').replace("postgres://", "postgresql://", 1)
+    SQLALCHEMY_BINDS = {'replica': DATABASE_REPLICA_URL} if DATABASE_REPLICA_URL else {}
+    DB_REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', 10))
+    # Web budget per statement; `flask jobs work` replaces it with JOB_STATEMENT_TIMEOUT_MS (0 = no limit)
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 5000))
     
+    # Password Hashing (weaker stored hashes are upgraded to this method on login; never downgraded)
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+    # Hashing processes for the whole node, split across WEB_CONCURRENCY workers with at least
+    # one each (e.g. 8 with 2 gthread workers = 4 each); 0, or gevent workers, hash inline
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    PASSWORD_HASH_TIMEOUT = int(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+
+    # Marketplace Page Cache (memory:// per process, or a redis:// URL shared by all workers)
+    PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', 'True') == 'True'
+    PAGE_CACHE_URL = os.getenv('PAGE_CACHE_URL', 'memory://')
+    PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 60))
+    # Product card fragments; 0 = automatic (10x PAGE_CACHE_TTL with redis://). With memory://
+    # cards never outlive a page, since other workers do not see the invalidation.
+    PAGE_CACHE_CARD_TTL = int(os.getenv('PAGE_CACHE_CARD_TTL', 0))
+    PAGE_CACHE_MAX_KEYS = int(os.getenv('PAGE_CACHE_MAX_KEYS', 2000))
+    MARKET_PER_PAGE = int(os.getenv('MARKET_PER_PAGE', 24))
+
+    # Job Queue (run workers with `flask --app app jobs work`)
+    JOB_LOCK_TIMEOUT = int(os.getenv('JOB_LOCK_TIMEOUT', 600))
+    JOB_RETRY_DELAY = int(os.getenv('JOB_RETRY_DELAY', 30))
+    JOB_STATEMENT_TIMEOUT_MS = int(os.getenv('JOB_STATEMENT_TIMEOUT_MS', 0))
+
+    # Order History
+    ORDERS_PER_PAGE = int(os.getenv('ORDERS_PER_PAGE', 10))
+    ORDER_ARCHIVE_AFTER_DAYS = int(os.getenv('ORDER_ARCHIVE_AFTER_DAYS', 30))
+
+    # Demand Forecasting
+    FORECAST_HISTORY_DAYS = int(os.getenv('FORECAST_HISTORY_DAYS', 84))
+    FORECAST_HORIZON_DAYS = int(os.getenv('FORECAST_HORIZON_DAYS', 7))
+
     # Mail Config
     MAIL_SERVER = os.getenv('MAIL_SERVER')
     MAIL_PORT = int(os.getenv('MAIL_PORT', 587))
@@ -15,21 +52,60 @@ class Config:
     MAIL_USERNAME = os.getenv('MAIL_USERNAME')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.getenv('MAIL_USERNAME')
+
+    # Rate Limiting (memory:// per process, or a redis:// URL shared by all workers)
+    RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', 'True') == 'True'
+    RATELIMIT_STORAGE_URL = os.getenv('RATELIMIT_STORAGE_URL', 'memory://')
+    RATELIMIT_MAX_KEYS = int(os.getenv('RATELIMIT_MAX_KEYS', 10000))
+    # Proxies in front of the app that append to X-Forwarded-For (the platform router is one);
+    # set to 0 when clients connect directly, otherwise they could spoof their IP
+    PROXY_FIX_X_FOR = int(os.getenv('PROXY_FIX_X_FOR', 1))
     
+    # Web Server Concurrency (read by gunicorn.conf.py as well)
+    WEB_WORKER_CLASS = os.getenv('WEB_WORKER_CLASS', 'sync')
+    WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', (os.cpu_count() or 1) * 2 + 1))
+    WEB_THREADS = int(os.getenv('WEB_THREADS', 8 if WEB_WORKER_CLASS == 'gthread' else 1))
+    WORKER_CONNECTIONS = int(os.getenv('WORKER_CONNECTIONS', 1000))
+    # Primary connections one node may open: each worker holds up to pool_size + max_overflow,
+    # e.g. 5 workers (2 CPUs) = 35 sync, 65 gthread, 150 gevent. gunicorn.conf.py warns past this.
+    DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', 100))
+
     # Optimized Engine Options
     engine_options = {
         "pool_pre_ping": True,
         "pool_recycle": 300,
     }
 
+    @classmethod
+    def get_pool_size(cls):
+        # Connections per worker process, matched to how many requests it serves at once
+        if os.getenv('DB_POOL_SIZE'):
+            return int(os.getenv('DB_POOL_SIZE'))
+        if cls.WEB_WORKER_CLASS == 'gthread':
+            return cls.WEB_THREADS
+        if cls.WEB_WORKER_CLASS == 'gevent':
+            # Greenlets queue on the pool instead of each holding a Postgres connection
+            return min(cls.WORKER_CONNECTIONS, 20)
+        return 2
+
+    @classmethod
+    def get_max_overflow(cls):
+        return int(os.getenv('DB_MAX_OVERFLOW', 10 if cls.WEB_WORKER_CLASS == 'gevent' else 5))
+
     @classmethod
     def get_engine_options(cls):
         options = cls.engine_options.copy()
+        if not cls.SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+            options["pool_size"] = cls.get_pool_size()
+            options["max_overflow"] = cls.get_max_overflow()
+            options["pool_timeout"] = int(os.getenv('DB_POOL_TIMEOUT', 10))
         if cls.SQLALCHEMY_DATABASE_URI.startswith('postgresql'):
             options["connect_args"] = {
                 "keepalives": 1,
                 "keepalives_idle": 30,
                 "keepalives_interval": 10,
                 "keepalives_count": 5,
+                # Per-statement timeout so one slow query cannot hold a pooled connection forever
+                "options": f"-c statement_timeout={cls.DB_STATEMENT_TIMEOUT_MS}",
             }
         return options
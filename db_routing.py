@@ -0,0 +1,46 @@
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+REPLICA_BIND = 'replica'
+
+def read_only(view):
+    # Marks a view whose queries may be served by the read replica
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        g.use_replica = True
+        return view(*args, **kwargs)
+    return wrapped
+
+class RoutingSession(Session):
+    """Sends reads from @read_only views to the replica bind and everything else to the primary.
+    A browser that just committed a write sticks to the primary for DB_REPLICA_STICKY_SECONDS."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.use_replica():
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def use_replica(self):
+        if not has_request_context() or not g.get('use_replica'):
+            return False
+        if REPLICA_BIND not in self._db.engines or self._flushing or self.info.get('wrote'):
+            return False
+        return session.get('primary_until', 0) < time.time()
+
+@event.listens_for(RoutingSession, 'after_flush')
+def mark_write(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def clear_write(db_session):
+    db_session.info.pop('wrote', None)
+
+@event.listens_for(RoutingSession, 'after_commit')
+def stick_to_primary(db_session):
+    if db_session.info.pop('wrote', False) and has_request_context():
+        # Read-your-writes: replicas may lag behind the commit we just made
+        session['primary_until'] = time.time() + current_app.config['DB_REPLICA_STICKY_SECONDS']
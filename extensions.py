@@ -2,8 +2,15 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_mail import Mail
 from flask_apscheduler import APScheduler
+from rate_limit import RateLimiter
+from db_routing import RoutingSession
+from page_cache import PageCache
+from job_queue import JobQueue
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 mail = Mail()
 login_manager = LoginManager()
 scheduler = APScheduler()
+limiter = RateLimiter()
+page_cache = PageCache()
+queue = JobQueue()
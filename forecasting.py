@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import delete, func, insert, select
+
+from extensions import db
+from models import Product, Order, OrderItem, ArchivedOrder, ArchivedOrderItem, RestockSuggestion
+
+CHUNK_ROWS = 100_000
+MIN_HISTORY_DAYS = 28 # the longest moving average; also covers every weekday
+SERVICE_LEVEL_Z = 1.65 # ~95% chance of not stocking out over the horizon
+
+def _weekdays(days):
+    # Monday = 0; 1970-01-01 was a Thursday
+    return (days.astype('datetime64[D]').astype(np.int64) + 3) % 7
+
+def load_daily_sales(product_ids, start, end):
+    """Returns a (products x days) matrix of units sold per day in [start, end). Live and
+    archived order lines are summed per product and day in the database and loaded as
+    columns, so the cost scales with products x days rather than with order lines."""
+    days = int((end - start) / np.timedelta64(1, 'D'))
+    daily = np.zeros(len(product_ids) * days)
+    start_dt, end_dt = start.astype('datetime64[s]').astype(datetime), end.astype('datetime64[s]').astype(datetime)
+
+    for order, item in ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)):
+        day_col = func.date(order.created_at)
+        stmt = select(item.product_id, day_col, func.sum(item.quantity)) \
+            .join(order, order.id == item.order_id) \
+            .where(order.status != 'Cancelled', order.created_at >= start_dt, order.created_at < end_dt) \
+            .group_by(item.product_id, day_col)
+        result = db.session.execute(stmt.execution_options(stream_results=True, yield_per=CHUNK_ROWS))
+        for chunk in result.partitions(CHUNK_ROWS):
+            pids, sold_on, qty = zip(*chunk)
+            pids = np.fromiter(pids, dtype=np.int64, count=len(chunk))
+            day = (np.array(sold_on, dtype='datetime64[D]') - start).astype(np.int64)
+            idx = np.searchsorted(product_ids, pids)
+            known = (idx < len(product_ids)) & (product_ids[np.minimum(idx, len(product_ids) - 1)] == pids)
+            daily += np.bincount(idx[known] * days + day[known],
+                                 weights=np.fromiter(qty, dtype=np.float64, count=len(chunk))[known],
+                                 minlength=daily.size)
+    return daily.reshape(len(product_ids), days)
+
+def forecast_demand(daily, start, horizon_days):
+    """Vectorized over every product at once. Returns the 7- and 28-day moving averages, the
+    weekday-seasonal forecast for the next horizon_days, and a safety stock for that horizon."""
+    avg_7 = daily[:, -7:].mean(axis=1)
+    avg_28 = daily[:, -28:].mean(axis=1)
+
+    # Weekday profile relative to each product's overall daily mean
+    history_weekdays = _weekdays(start + np.arange(daily.shape[1]))
+    by_weekday = np.stack([daily[:, history_weekdays == d].mean(axis=1) if (history_weekdays == d).any()
+                           else np.zeros(daily.shape[0]) for d in range(7)], axis=1)
+    overall = daily.mean(axis=1, keepdims=True)
+    seasonal = np.divide(by_weekday, overall, out=np.ones_like(by_weekday), where=overall > 0)
+
+    # Level blends short and long averages so recent trend shifts show through
+    level = (avg_7 + avg_28) / 2
+    future_weekdays = _weekdays(start + daily.shape[1] + np.arange(horizon_days))
+    forecast = (level[:, None] * seasonal[:, future_weekdays]).sum(axis=1)
+    safety = SERVICE_LEVEL_Z * daily[:, -28:].std(axis=1) * np.sqrt(horizon_days)
+    return tuple(np.nan_to_num(a) for a in (avg_7, avg_28, forecast, safety))
+
+def refresh_restock_suggestions(history_days=84, horizon_days=7):
+    """Batch job: recomputes restock suggestions for every active product. Returns the product count."""
+    if history_days < MIN_HISTORY_DAYS:
+        raise ValueError(f"history_days must be at least {MIN_HISTORY_DAYS} for the 28-day average, got {history_days}")
+    products = db.session.execute(
+        select(Product.id, Product.stock).where(Product.is_deleted == False).order_by(Product.id)
+    ).all()
+    if not products:
+        return 0
+    product_ids = np.array([p.id for p in products], dtype=np.int64)
+    stock = np.array([p.stock or 0 for p in products], dtype=np.float64)
+
+    end = np.datetime64(datetime.utcnow().date(), 'D')
+    start = end - np.timedelta64(history_days, 'D')
+    daily = load_daily_sales(product_ids, start, end)
+    avg_7, avg_28, forecast, safety = forecast_demand(daily, start, horizon_days)
+    suggested = np.ceil(np.maximum(0, forecast + safety - stock)).astype(np.int64)
+
+    generated_at = datetime.utcnow()
+    db.session.execute(delete(RestockSuggestion))
+    db.session.execute(insert(RestockSuggestion), [
+        {'product_id': int(pid), 'avg_daily_7': float(a7), 'avg_daily_28': float(a28),
+         'forecast_qty': float(f), 'suggested_qty': int(s), 'generated_at': generated_at}
+        for pid, a7, a28, f, s in zip(product_ids, avg_7, avg_28, forecast, suggested)
+    ])
+    db.session.commit()
+    return len(product_ids)
@@ -0,0 +1,34 @@
+import multiprocessing
+import os
+
+# Serving mode: "sync" (one request per worker), "gthread" (thread pool per worker)
+# or "gevent" (greenlets, suited to many long-lived polling connections)
+worker_class = os.getenv('WEB_WORKER_CLASS', 'sync')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('WEB_THREADS', 8 if worker_class == 'gthread' else 1))
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', 1000))
+timeout = int(os.getenv('WEB_TIMEOUT', 30))
+keepalive = int(os.getenv('WEB_KEEPALIVE', 5 if worker_class != 'sync' else 2))
+bind = os.getenv('BIND', f"0.0.0.0:{os.getenv('PORT', '8000')}")
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # Let psycopg2 yield to other greenlets while waiting on Postgres
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen not installed; Postgres queries will block gevent workers")
+
+def on_starting(server):
+    # Every worker has its own pool, so the node total is workers x (pool_size + max_overflow)
+    from database_config import Config
+    if Config.SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+        return
+    per_worker = Config.get_pool_size() + Config.get_max_overflow()
+    total = workers * per_worker
+    if total > Config.DB_MAX_CONNECTIONS:
+        server.log.warning(
+            "%d workers x %d DB connections = %d, above DB_MAX_CONNECTIONS=%d; "
+            "lower WEB_CONCURRENCY, DB_POOL_SIZE or DB_MAX_OVERFLOW",
+            workers, per_worker, total, Config.DB_MAX_CONNECTIONS)
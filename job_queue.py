@@ -0,0 +1,236 @@
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+class JobQueue:
+    """Small DB-backed job queue. Work is enqueued in the caller's transaction, so a job
+    only becomes visible once the order (or whatever it belongs to) is committed."""
+
+    def __init__(self, app=None):
+        self.tasks = {}
+        self.lock_timeout = 600
+        self.retry_delay = 30
+        self.statement_timeout_ms = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.lock_timeout = app.config.get('JOB_LOCK_TIMEOUT', 600)
+        self.retry_delay = app.config.get('JOB_RETRY_DELAY', 30)
+        self.statement_timeout_ms = app.config.get('JOB_STATEMENT_TIMEOUT_MS', 0)
+        app.cli.add_command(jobs_cli)
+
+    def task(self, name):
+        def decorator(func):
+            self.tasks[name] = func
+            return func
+        return decorator
+
+    def enqueue(self, name, payload=None, priority=0, delay=0, idempotency_key=None, max_attempts=3):
+        """Adds a job to the current session (the caller commits). With an idempotency_key,
+        a second enqueue of the same key returns the existing job instead of a duplicate."""
+        from extensions import db
+        from models import Job
+        if name not in self.tasks:
+            raise ValueError(f"Unknown job: {name}")
+        if idempotency_key:
+            existing = Job.query.filter_by(idempotency_key=idempotency_key).first()
+            if existing:
+                return existing
+        job = Job(name=name, payload=json.dumps(payload or {}), priority=priority, max_attempts=max_attempts,
+                  idempotency_key=idempotency_key, run_at=datetime.utcnow() + timedelta(seconds=delay))
+        try:
+            with db.session.begin_nested():
+                db.session.add(job)
+        except IntegrityError:
+            # Another process enqueued the same key between our check and insert
+            return Job.query.filter_by(idempotency_key=idempotency_key).first()
+        return job
+
+    def claim(self, worker_id):
+        """Claims the next due job, or a running job whose lock has expired (crashed worker)."""
+        from extensions import db
+        from models import Job
+        now = datetime.utcnow()
+        due = select(Job.id).where(
+            Job.run_at <= now,
+            or_(Job.status == 'queued',
+                (Job.status == 'running') & (Job.locked_at < now - timedelta(seconds=self.lock_timeout)))
+        ).order_by(Job.priority.desc(), Job.run_at, Job.id).limit(1)
+        if db.engine.dialect.name == 'postgresql':
+            # Concurrent workers skip rows another worker is claiming instead of queueing behind it
+            due = due.with_for_update(skip_locked=True)
+        job_id = db.session.execute(due).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+        # Conditional update doubles as the claim on SQLite, which has no row locks
+        claimed = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status.in_(['queued', 'running']),
+                              or_(Job.locked_at.is_(None), Job.locked_at < now - timedelta(seconds=self.lock_timeout)))
+            .values(status='running', locked_by=worker_id, locked_at=now, attempts=Job.attempts + 1)
+        ).rowcount
+        db.session.commit()
+        return db.session.get(Job, job_id) if claimed else None
+
+    def execute(self, job):
+        from extensions import db
+        from models import Job
+        job_id, name, payload = job.id, job.name, json.loads(job.payload or '{}')
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(db.engine, job_id, job.locked_by, stop), daemon=True)
+        heartbeat.start()
+        started = time.monotonic()
+        try:
+            self.tasks[name](**payload)
+            db.session.commit()
+            error = None
+        except Exception:
+            db.session.rollback()
+            error = traceback.format_exc()
+        finally:
+            stop.set()
+            heartbeat.join()
+        job = db.session.get(Job, job_id)
+        job.duration_ms = (time.monotonic() - started) * 1000
+        job.locked_by = job.locked_at = None
+        if error is None:
+            job.status = 'done'
+            job.finished_at = datetime.utcnow()
+        elif job.attempts < job.max_attempts:
+            # Exponential backoff: 30s, 60s, 120s, ...
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + timedelta(seconds=self.retry_delay * 2 ** (job.attempts - 1))
+            job.last_error = error
+        else:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+            job.last_error = error
+        db.session.commit()
+        print(f"[jobs] {name} #{job_id} {job.status} in {job.duration_ms:.0f}ms (attempt {job.attempts})")
+        return job
+
+    def _heartbeat(self, engine, job_id, worker_id, stop):
+        """Refreshes locked_at while a job runs, so claim() never treats a long archival or
+        forecast run as abandoned and hands it to a second worker."""
+        from models import Job
+        while not stop.wait(self.lock_timeout / 3):
+            try:
+                with engine.begin() as conn:
+                    conn.execute(update(Job).where(Job.id == job_id, Job.locked_by == worker_id)
+                                 .values(locked_at=datetime.utcnow()))
+            except Exception as e:
+                print(f"[jobs] heartbeat for #{job_id} failed: {e}")
+
+    def use_job_statement_timeout(self):
+        """The engines are built with the web DB_STATEMENT_TIMEOUT_MS, which would cancel
+        archival and forecasting batches. Worker connections use JOB_STATEMENT_TIMEOUT_MS instead."""
+        from extensions import db
+        for engine in db.engines.values():
+            if engine.dialect.name != 'postgresql' or event.contains(engine, 'connect', self._set_statement_timeout):
+                continue
+            event.listen(engine, 'connect', self._set_statement_timeout)
+            # Connections opened before the listener still carry the web timeout
+            engine.dispose()
+
+    def _set_statement_timeout(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"SET statement_timeout = {int(self.statement_timeout_ms)}")
+        cursor.close()
+        # Committed so the pool's rollback on checkin does not undo it
+        dbapi_connection.commit()
+
+    def work(self, worker_id=None, burst=False, poll_interval=1.0):
+        from extensions import db
+        worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.use_job_statement_timeout()
+        processed = 0
+        while True:
+            job = self.claim(worker_id)
+            if job is None:
+                if burst:
+                    return processed
+                time.sleep(poll_interval)
+                continue
+            if job.name not in self.tasks:
+                job.status, job.last_error = 'failed', f"Unknown job: {job.name}"
+                db.session.commit()
+                continue
+            self.execute(job)
+            processed += 1
+
+jobs_cli = AppGroup('jobs', help='Inspect and run the background job queue.')
+
+@jobs_cli.command('work')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty.')
+@click.option('--interval', default=1.0, help='Seconds to wait when the queue is empty.')
+def work_command(burst, interval):
+    from extensions import queue
+    processed = queue.work(burst=burst, poll_interval=interval)
+    click.echo(f"Processed {processed} jobs.")
+
+@jobs_cli.command('list')
+@click.option('--status', default=None, help='queued, running, done or failed')
+@click.option('--limit', default=20)
+def list_command(status, limit):
+    from models import Job
+    query = Job.query.order_by(Job.id.desc())
+    if status:
+        query = query.filter_by(status=status)
+    for job in query.limit(limit).all():
+        duration = f"{job.duration_ms:.0f}ms" if job.duration_ms is not None else '-'
+        click.echo(f"#{job.id:<6} {job.name:<25} {job.status:<8} prio={job.priority} "
+                   f"attempts={job.attempts}/{job.max_attempts} run_at={job.run_at:%Y-%m-%d %H:%M:%S} {duration}")
+
+@jobs_cli.command('stats')
+def stats_command():
+    from extensions import db
+    from models import Job
+    rows = db.session.execute(
+        select(Job.name, Job.status, func.count(Job.id), func.avg(Job.duration_ms), func.max(Job.duration_ms))
+        .group_by(Job.name, Job.status).order_by(Job.name, Job.status)
+    ).all()
+    click.echo(f"{'job':<25}{'status':<10}{'count':>7}{'avg ms':>10}{'max ms':>10}")
+    for name, status, count, avg_ms, max_ms in rows:
+        click.echo(f"{name:<25}{status:<10}{count:>7}{avg_ms or 0:>10.0f}{max_ms or 0:>10.0f}")
+
+@jobs_cli.command('retry')
+@click.argument('job_id', type=int)
+def retry_command(job_id):
+    from extensions import db
+    from models import Job
+    job = db.session.get(Job, job_id)
+    if job is None or job.status != 'failed':
+        raise click.ClickException(f"Job #{job_id} is not a failed job.")
+    job.status, job.attempts, job.run_at = 'queued', 0, datetime.utcnow()
+    db.session.commit()
+    click.echo(f"Job #{job_id} requeued.")
+
+@jobs_cli.command('enqueue')
+@click.argument('name')
+@click.option('--payload', default='{}', help='JSON keyword arguments for the task.')
+@click.option('--priority', default=0)
+def enqueue_command(name, payload, priority):
+    from extensions import db, queue
+    job = queue.enqueue(name, json.loads(payload), priority=priority)
+    db.session.commit()
+    click.echo(f"Enqueued {name} as job #{job.id}.")
+
+@jobs_cli.command('purge')
+@click.option('--older-than-days', default=7)
+def purge_command(older_than_days):
+    from extensions import db
+    from models import Job
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    deleted = Job.query.filter(Job.status == 'done', Job.finished_at < cutoff).delete()
+    db.session.commit()
+    click.echo(f"Purged {deleted} finished jobs.")
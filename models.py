@@ -63,32 +63,88 @@ class Product(db.Model):
 class Order(db.Model):
     __tablename__ = 'orders'
     id = db.Column(db.Integer, primary_key=True)
-    consumer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    delivery_partner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    consumer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    delivery_partner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
     total_amount = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(50), default='Pending') # Pending, Ready, Out for Delivery, Delivered, Cancelled
+    status = db.Column(db.String(50), default='Pending', index=True) # Pending, Ready, Out for Delivery, Delivered, Cancelled
     payment_method = db.Column(db.String(20)) # UPI, COD
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     pickup_address = db.Column(db.Text)
     drop_address = db.Column(db.Text)
     pickup_phone = db.Column(db.String(20))
     drop_phone = db.Column(db.String(20))
+
+    # Multi-farm carts: the consumer-facing parent order holds the items,
+    # each child leg covers the pickup from a single farm
+    parent_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=True)
+    farmer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     
     items = db.relationship('OrderItem', backref='order', lazy=True)
+    legs = db.relationship('Order', backref=db.backref('parent', remote_side=[id]), lazy=True)
     transaction = db.relationship('Transaction', backref='order', uselist=False)
 
     # Explicit relationships for user roles
     consumer = db.relationship('User', foreign_keys=[consumer_id], backref=db.backref('consumer_orders', lazy=True))
     delivery_partner = db.relationship('User', foreign_keys=[delivery_partner_id], backref=db.backref('assigned_deliveries', lazy=True))
+    farmer = db.relationship('User', foreign_keys=[farmer_id])
+
+    # Archived ids must never be handed out again; SQLite otherwise reuses the highest id once deleted
+    __table_args__ = {'sqlite_autoincrement': True}
 
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+
+    __table_args__ = {'sqlite_autoincrement': True}
+
+# Delivered and Cancelled orders are moved here by the archival job (see archival.py),
+# keeping their original ids, so the orders table only holds recent and active orders
+class ArchivedOrder(db.Model):
+    __tablename__ = 'orders_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    consumer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    delivery_partner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
+    total_amount = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(50))
+    payment_method = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime)
+    pickup_address = db.Column(db.Text)
+    drop_address = db.Column(db.Text)
+    pickup_phone = db.Column(db.String(20))
+    drop_phone = db.Column(db.String(20))
+    parent_id = db.Column(db.Integer, nullable=True)
+    farmer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    items = db.relationship('ArchivedOrderItem', backref='order', lazy=True)
+
+class ArchivedOrderItem(db.Model):
+    __tablename__ = 'order_items_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders_archive.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
 
+    product = db.relationship('Product')
+
+# Written in bulk by the forecasting job (see forecasting.py), one row per product
+class RestockSuggestion(db.Model):
+    __tablename__ = 'restock_suggestions'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), unique=True, nullable=False)
+    avg_daily_7 = db.Column(db.Float, default=0.0) # 7-day moving average of units sold
+    avg_daily_28 = db.Column(db.Float, default=0.0)
+    forecast_qty = db.Column(db.Float, default=0.0) # Expected units sold over the forecast horizon
+    suggested_qty = db.Column(db.Integer, default=0) # Units to add on top of current stock
+    generated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    product = db.relationship('Product', backref=db.backref('restock_suggestion', uselist=False))
+
 class FarmerProfile(db.Model):
     __tablename__ = 'farmer_profiles'
     id = db.Column(db.Integer, primary_key=True)
@@ -187,3 +243,24 @@ class InventoryAudit(db.Model):
     stock_change = db.Column(db.Integer) # positive or negative
     reason = db.Column(db.String(100)) # Sale, Restock, Correction
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Deferred and scheduled work, claimed by `flask jobs work` (see job_queue.py)
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False) # Registered task name
+    payload = db.Column(db.Text, default='{}') # JSON keyword arguments
+    status = db.Column(db.String(20), default='queued') # queued, running, done, failed
+    priority = db.Column(db.Integer, default=0) # Higher runs first
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    idempotency_key = db.Column(db.String(100), unique=True)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Float)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_jobs_claim', 'status', 'priority', 'run_at'),)
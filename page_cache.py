@@ -0,0 +1,221 @@
+import gzip
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from functools import wraps
+from threading import Lock
+
+from flask import Response, g, render_template, request, session
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CARD_VARIANTS = ('anon', 'consumer', 'other')
+
+class MemoryStore:
+    """Per-process store with TTLs; least recently used keys are evicted past max_keys."""
+
+    def __init__(self, max_keys=2000):
+        self.max_keys = max_keys
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at and expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (time.time() + ttl if ttl else None, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_keys:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    get_value = get
+    set_value = set
+
+    def incr(self, key):
+        with self.lock:
+            value = (self.entries.get(key, (None, 0))[1]) + 1
+            self.entries[key] = (None, value)
+            return value
+
+class RedisStore:
+    """Shared store, so a catalog write on one worker invalidates pages on all of them."""
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    def get(self, key):
+        value = self.client.hgetall(f'pagecache:{key}')
+        return {k.decode(): v for k, v in value.items()} if value else None
+
+    def set(self, key, value, ttl=None):
+        pipe = self.client.pipeline()
+        pipe.hset(f'pagecache:{key}', mapping=value)
+        if ttl:
+            pipe.expire(f'pagecache:{key}', ttl)
+        pipe.execute()
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[f'pagecache:{key}' for key in keys])
+
+    def get_value(self, key):
+        return self.client.get(f'pagecache:{key}')
+
+    def set_value(self, key, value):
+        self.client.set(f'pagecache:{key}', value)
+
+    def incr(self, key):
+        return self.client.incr(f'pagecache:{key}')
+
+class PageCache:
+    def __init__(self, app=None):
+        self.store = None
+        self.enabled = True
+        self.ttl = 60
+        self.card_ttl = 60
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PAGE_CACHE_ENABLED', True)
+        self.ttl = app.config.get('PAGE_CACHE_TTL', 60)
+        url = app.config.get('PAGE_CACHE_URL') or 'memory://'
+        self.store = MemoryStore(app.config.get('PAGE_CACHE_MAX_KEYS', 2000)) if url.startswith('memory://') else RedisStore(url)
+        # A per-process store only drops cards in the worker that made the write, so other
+        # workers must not keep a card (and its stock badge) longer than a page
+        shared = isinstance(self.store, RedisStore)
+        self.card_ttl = app.config.get('PAGE_CACHE_CARD_TTL') or (self.ttl * 10 if shared else self.ttl)
+        if not shared:
+            self.card_ttl = min(self.card_ttl, self.ttl)
+        app.jinja_env.globals['product_card'] = self.product_card
+        event.listen(Session, 'after_flush', self._collect_catalog_writes)
+        event.listen(Session, 'after_commit', self._invalidate_after_commit)
+        event.listen(Session, 'after_rollback', lambda db_session: db_session.info.pop('catalog_writes', None))
+
+    # Invalidation
+
+    def catalog_version(self):
+        return int(self.store.get_value('catalog:version') or 0)
+
+    def last_modified(self):
+        modified = self.store.get_value('catalog:modified')
+        if modified is None:
+            modified = int(time.time())
+            self.store.set_value('catalog:modified', modified)
+        return int(modified)
+
+    def invalidate_catalog(self, product_ids=()):
+        # Bumping the version orphans every cached page; cards are dropped per product
+        self.store.incr('catalog:version')
+        self.store.set_value('catalog:modified', int(time.time()))
+        self.store.delete(*[f'card:{pid}:{variant}' for pid in product_ids for variant in CARD_VARIANTS])
+
+    def _collect_catalog_writes(self, db_session, flush_context):
+        from models import Product, Category
+        writes = db_session.info.setdefault('catalog_writes', set())
+        for obj in list(db_session.new) + list(db_session.dirty) + list(db_session.deleted):
+            if isinstance(obj, Product):
+                writes.add(obj.id)
+            elif isinstance(obj, Category):
+                writes.add(None)
+
+    def _invalidate_after_commit(self, db_session):
+        writes = db_session.info.pop('catalog_writes', None)
+        if writes and self.store is not None:
+            self.invalidate_catalog([pid for pid in writes if pid is not None])
+
+    # Full pages
+
+    def cached_page(self, *vary_args):
+        """Caches the rendered page for anonymous visitors, keyed by the given query args,
+        and serves it compressed with Cache-Control / Last-Modified for reverse proxies."""
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                if not self.enabled or session.get('_user_id') or session.get('_flashes'):
+                    return view(*args, **kwargs)
+                key = ':'.join([f'page:{self.catalog_version()}', request.endpoint] +
+                               [request.args.get(arg, '') for arg in vary_args])
+                entry = self.store.get(key)
+                if entry is None:
+                    # The page is shared by everyone with the same vary_args, so links built
+                    # while rendering (see url_for_page) must not carry any other query args
+                    g.page_cache_vary_args = vary_args
+                    html = view(*args, **kwargs)
+                    if not isinstance(html, str):
+                        return html
+                    entry = self._compress(html.encode())
+                    entry['modified'] = self.last_modified()
+                    self.store.set(key, entry, self.ttl)
+                return self._respond(entry)
+            return wrapped
+        return decorator
+
+    def _compress(self, body):
+        entry = {'body': body, 'gzip': gzip.compress(body, 6)}
+        if brotli is not None:
+            entry['br'] = brotli.compress(body, quality=5)
+        return entry
+
+    def _respond(self, entry):
+        modified = int(entry['modified'])
+        headers = {
+            'Cache-Control': f'public, max-age={self.ttl}',
+            'Last-Modified': formatdate(modified, usegmt=True),
+            'Vary': 'Accept-Encoding',
+        }
+        since = request.headers.get('If-Modified-Since')
+        if since:
+            try:
+                if parsedate_to_datetime(since).timestamp() >= modified:
+                    return Response(status=304, headers=headers)
+            except (TypeError, ValueError):
+                pass
+        encodings = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in entry and encodings[encoding]:
+                headers['Content-Encoding'] = encoding
+                return Response(entry[encoding], mimetype='text/html', headers=headers)
+        return Response(entry['body'], mimetype='text/html', headers=headers)
+
+    # Fragments
+
+    def product_card(self, product):
+        if not current_user.is_authenticated:
+            variant = 'anon'
+        else:
+            variant = 'consumer' if current_user.role == 'consumer' else 'other'
+        key = f'card:{product.id}:{variant}'
+        html = self.store.get(key) if self.enabled else None
+        if html is None:
+            html = render_template('product_card.html', product=product)
+            if self.enabled:
+                self.store.set(key, {'html': html.encode()}, self.card_ttl)
+        else:
+            html = html['html'].decode()
+        return Markup(html)
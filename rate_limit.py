@@ -0,0 +1,123 @@
+import math
+import re
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import request, session
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+def parse_rate(rate):
+    # "5/minute", "3/10minutes" -> (capacity, seconds)
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day)s?\s*', rate)
+    if not match:
+        raise ValueError(f"Invalid rate limit: {rate}")
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * PERIODS[unit]
+
+class MemoryBackend:
+    """Token buckets kept in this process. Least recently used keys are evicted past max_keys."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = Lock()
+
+    def take(self, key, capacity, period):
+        refill_rate = capacity / period
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * refill_rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        retry_after = 0 if allowed else math.ceil((1 - tokens) / refill_rate)
+        return allowed, retry_after
+
+class RedisBackend:
+    """Token buckets shared between workers and nodes. Idle keys expire once full again."""
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local period = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local rate = capacity / period
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(period))
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.script = client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, period):
+        allowed, tokens = self.script(keys=[f'ratelimit:{key}'], args=[capacity, period, time.time()])
+        if int(allowed):
+            return True, 0
+        return False, math.ceil((1 - float(tokens)) * period / capacity)
+
+class RateLimiter:
+    def __init__(self, app=None):
+        self.backend = None
+        self.enabled = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATELIMIT_ENABLED', True)
+        storage_url = app.config.get('RATELIMIT_STORAGE_URL') or 'memory://'
+        if storage_url.startswith('memory://'):
+            self.backend = MemoryBackend(app.config.get('RATELIMIT_MAX_KEYS', 10000))
+        else:
+            self.backend = RedisBackend(storage_url)
+
+    def limit(self, rate, scope='ip', methods=None):
+        capacity, period = parse_rate(rate)
+
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                if self.enabled and self.backend and (methods is None or request.method in methods):
+                    key = f'{view.__name__}:{rate}:{client_key(scope)}'
+                    allowed, retry_after = self.backend.take(key, capacity, period)
+                    if not allowed:
+                        return too_many_requests(retry_after)
+                return view(*args, **kwargs)
+            return wrapped
+        return decorator
+
+def client_key(scope):
+    if scope == 'user':
+        # Read from the signed session so limiting never loads the User row
+        if session.get('_user_id'):
+            return f'user:{session["_user_id"]}'
+        if session.get('user_id_temp'):
+            return f'user:{session["user_id_temp"]}'
+        if request.form.get('email'):
+            return f'email:{request.form["email"].strip().lower()}'
+    return f'ip:{request.remote_addr}'
+
+def too_many_requests(retry_after):
+    headers = {'Retry-After': str(max(1, retry_after))}
+    if request.path.startswith('/api/'):
+        return {'error': 'Too many requests'}, 429, headers
+    return 'Too many requests. Please try again later.', 429, headers
@@ -0,0 +1,85 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+_db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ['VERCEL'] = '1' # no scheduler
+
+from sqlalchemy import text
+from sqlalchemy.schema import CreateTable
+
+from app import app
+from archival import archive_finished_orders, ensure_sqlite_autoincrement
+from extensions import db
+from models import User, Product, Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+
+@pytest.fixture
+def ctx():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        consumer = User(email='c@example.com', password_hash='x', role='consumer', name='C', is_verified=True)
+        farmer = User(email='f@example.com', password_hash='x', role='farmer', name='F', is_verified=True)
+        db.session.add_all([consumer, farmer])
+        db.session.commit()
+        product = Product(name='Tomato', price=10, stock=50, unit='kg', farmer_id=farmer.id)
+        db.session.add(product)
+        db.session.commit()
+        yield consumer, product
+        db.session.remove()
+
+def place_order(consumer, product, status='Delivered', days_ago=60):
+    order = Order(consumer_id=consumer.id, total_amount=20, status=status,
+                  created_at=datetime.utcnow() - timedelta(days=days_ago))
+    db.session.add(order)
+    db.session.flush()
+    db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=2, price=10))
+    db.session.commit()
+    return order
+
+def archive_newest_then_reorder(consumer, product):
+    first = place_order(consumer, product)
+    first_item_id = first.items[0].id
+    assert archive_finished_orders(30) == 1
+
+    # The newest order is gone from orders; its id must not be handed out again
+    second = place_order(consumer, product)
+    assert second.id > first.id
+    assert second.items[0].id > first_item_id
+    assert archive_finished_orders(30) == 1
+    assert ArchivedOrder.query.count() == 2
+    assert ArchivedOrderItem.query.count() == 2
+
+def test_archived_ids_are_not_reused(ctx):
+    archive_newest_then_reorder(*ctx)
+
+def test_legacy_sqlite_tables_are_rebuilt(ctx):
+    consumer, product = ctx
+    # Recreate orders / order_items the way older databases have them, without AUTOINCREMENT
+    with db.engine.begin() as conn:
+        for table in (OrderItem.__table__, Order.__table__):
+            conn.exec_driver_sql(f'DROP TABLE {table.name}')
+        for table in (Order.__table__, OrderItem.__table__):
+            conn.exec_driver_sql(str(CreateTable(table).compile(dialect=conn.dialect)).replace(' AUTOINCREMENT', ''))
+    kept = place_order(consumer, product, status='Pending')
+
+    ensure_sqlite_autoincrement()
+
+    ddl = db.session.execute(text("SELECT sql FROM sqlite_master WHERE name = 'orders'")).scalar()
+    assert 'AUTOINCREMENT' in ddl
+    assert db.session.get(Order, kept.id).items[0].quantity == 2
+    archive_newest_then_reorder(consumer, product)
+
+def test_sequence_is_raised_above_archived_ids(ctx):
+    consumer, product = ctx
+    # An archive written before the migration may already hold the highest id
+    db.session.add(ArchivedOrder(id=40, consumer_id=consumer.id, total_amount=5, status='Delivered'))
+    db.session.commit()
+
+    ensure_sqlite_autoincrement()
+
+    assert place_order(consumer, product, status='Pending').id == 41